@@ -1,14 +1,19 @@
 # -*- coding: utf8 -*-
 
-from .ycmd import http_client, exceptions
+from .ycmd import http_client, exceptions, router, trace
 from base64 import b64decode
+from collections import OrderedDict
+from contextlib import closing
+from itertools import islice
 from json import loads
-from threading import Thread
+from threading import Event, Lock, Thread
 import os
+import re
 import sublime
 import sublime_plugin
 import subprocess
-from .lang_map import LANG_MAP
+import time
+from .lang_map import EXTENSION_MAP, LANG_MAP, TRIGGER_MAP
 
 
 PACKAGE_NAME = os.path.splitext(os.path.basename(os.path.dirname(__file__)))[0]
@@ -31,9 +36,27 @@ PRINT_MODULE_NOT_AVAILABLE_TEMPLATE = "[Ycmd][{}] Command not available"
 PRINT_ERROR_MESSAGE_TEMPLATE = "[Ycmd] > {} ({},{})"
 LANGUAGE_NOT_SUPPORTED_MSG = "[Ycmd][ConfigError] Language '{}' specified " \
                              "in settings file is not supported by ycmd"
+PREFETCH_ERROR_MSG = "[Ycmd][Prefetch] Error {}"
+PREFETCH_STATS_TEMPLATE = "[Ycmd][Prefetch] issued: {issued}, hits: {hits}, misses: {misses}, " \
+                          "cancelled: {cancelled}, dropped: {dropped}"
+LIMITER_STATS_TEMPLATE = "[Ycmd][{location}] limit: {limit}, in flight: {in_flight}, " \
+                         "queued: {queued}, latency: {ewma_latency_ms}ms, " \
+                         "blocked for: {blocked_for}s, shed: {shed}, coalesced: {coalesced}"
+ROUTER_STATUS_TEMPLATE = "[Ycmd][{}] {}"
+PREPARSE_ERROR_MSG = "[Ycmd][Preparse] Error {}"
+PREPARSE_PROGRESS_TEMPLATE = "[Ycmd][Preparse] {done}/{total} files parsed"
+PREPARSE_CANCELLED_TEMPLATE = "[Ycmd][Preparse] Cancelled after {done}/{total} files"
+PREPARSE_NOTHING_MSG = "[Ycmd][Preparse] No source files found in project"
+
+IDENTIFIER_CHAR = re.compile(r'\w')
+# Time spent applying diagnostics per main thread slice, in seconds
+HIGHLIGHT_SLICE = 0.008
 
 LOCAL_SERVER = None
 USER_LANGUAGES = None
+ROUTER = None
+# get_client is called from many threads, only one of them may build the router
+ROUTER_LOCK = Lock()
 
 
 def print_status(msg):
@@ -61,25 +84,67 @@ def start_server(settings):
         print_status("[Ycmd] Local Server started at: {}".format(LOCAL_SERVER._server_location))
 
 
-def get_client(settings=None):
+def get_router(settings):
+    global ROUTER
+    with ROUTER_LOCK:
+        if ROUTER is None or ROUTER.servers != settings["servers"]:
+            if ROUTER:
+                ROUTER.Stop()
+            ROUTER = router.ServerRing(settings["servers"],
+                                       settings["server_health_check_interval"],
+                                       settings["server_slow_latency"])
+        return ROUTER
+
+
+def route_key(filepath):
+    ''' Returns the project folder containing filepath (as sent to ycmd) or its directory '''
+    key = None
+    for window in sublime.windows():
+        for folder in window.folders():
+            folder = get_file_path(folder).rstrip(os.sep) + os.sep
+            if filepath.startswith(folder) and (key is None or len(folder) > len(key)):
+                key = folder
+    return key or os.path.dirname(filepath)
+
+
+def get_client(settings=None, filepath=None):
     if not settings:
         settings = read_settings()
     if settings['use_auto']:
         return LOCAL_SERVER
     else:
-        return http_client.YcmdClient(0, settings["server"], settings["port"], settings["hmac"])
+        return get_router(settings).ClientFor(route_key(filepath or get_file_path()))
+
+
+def configure_tracing(settings):
+    if settings['trace_path']:
+        print('[Ycmd] Recording requests to {}'.format(settings['trace_path']))
+        http_client.SetTraceRecorder(trace.TraceRecorder(settings['trace_path'],
+                                                         settings['trace_include_contents']))
+    else:
+        http_client.SetTraceRecorder(None)
+
+
+def configure_limiters(settings):
+    http_client.ConfigureLimiters(1, settings['client_max_in_flight'],
+                                  settings['client_latency_target'],
+                                  settings['client_max_queued'])
 
 
 def plugin_loaded():
     from imp import reload
     reload(http_client)
     settings = read_settings()
+    configure_tracing(settings)
+    configure_limiters(settings)
     if settings['use_auto']:
         print('[Ycmd] Plugin loaded with autostart. Starting Ycmd.')
         start_server(settings)
 
 
 def plugin_unloaded():
+    if ROUTER:
+        ROUTER.Stop()
     print('[Ycmd] Plugin unloaded, so killing server.')
     LOCAL_SERVER.Shutdown()
 
@@ -100,6 +165,13 @@ def load_active_languages(settings):
     return languages
 
 
+def decode_hmac(hmac):
+    if not hmac or str(hmac) == "_some_base64_key_here_==":
+        print_status(NO_HMAC_MESSAGE)
+        return hmac
+    return b64decode(hmac.encode('utf-8'))
+
+
 def read_settings():
     s = sublime.load_settings(SETTINGS_NAME)
     settings = dict()
@@ -112,12 +184,37 @@ def read_settings():
     settings["default_settings_path"] = s.get(
         "default_settings_path", os.path.join(settings["ycmd_path"], "default_settings.json"))
     settings["languages"] = s.get("languages", ["cpp"])
+    settings["prefetch"] = s.get("prefetch_completions", True)
+    settings["prefetch_idle_delay"] = s.get("prefetch_idle_delay_ms", 400)
+    settings["prefetch_ttl"] = s.get("prefetch_ttl_ms", 5000) / 1000.0
+    settings["prefetch_max_in_flight"] = s.get("prefetch_max_in_flight", 2)
+    settings["preparse_on_project_open"] = s.get("preparse_on_project_open", False)
+    settings["preparse_workers"] = s.get("preparse_workers", 2)
+    settings["preparse_files_per_second"] = s.get("preparse_files_per_second", 4)
+    settings["preparse_max_files"] = s.get("preparse_max_files", 2000)
+    settings["diagnostics_cache_max_files"] = s.get("diagnostics_cache_max_files", 200)
+    settings["diagnostics_max_per_file"] = s.get("diagnostics_max_per_file", 2000)
+    settings["completions_max_items"] = s.get("completions_max_items", 1000)
+    settings["client_max_in_flight"] = s.get("client_max_in_flight", 8)
+    settings["client_latency_target"] = s.get("client_latency_target_ms", 1000) / 1000.0
+    settings["client_max_queued"] = s.get("client_max_queued", 8)
+    settings["trace_path"] = os.path.expanduser(s.get("trace_path", ""))
+    settings["trace_include_contents"] = s.get("trace_include_contents", False)
+
+    settings["server_health_check_interval"] = s.get("server_health_check_interval_ms",
+                                                     10000) / 1000.0
+    settings["server_slow_latency"] = s.get("server_slow_latency_ms", 500) / 1000.0
 
     if not settings['use_auto']:
-        if not settings["hmac"] or str(settings['hmac']) == "_some_base64_key_here_==":
-            print_status(NO_HMAC_MESSAGE)
+        settings["hmac"] = decode_hmac(settings["hmac"])
+        servers = s.get("ycmd_servers", [])
+        if servers:
+            settings["servers"] = tuple(
+                (server.get("server", settings["server"]), server.get("port", settings["port"]),
+                 decode_hmac(server["HMAC"]) if "HMAC" in server else settings["hmac"])
+                for server in servers)
         else:
-            settings["hmac"] = b64decode(settings["hmac"].encode('utf-8'))
+            settings["servers"] = ((settings["server"], settings["port"], settings["hmac"]),)
 
     settings["replace_file_path"] = (None, None)
     replace = s.get("ycmd_filepath_replace", {})
@@ -127,16 +224,28 @@ def read_settings():
     return settings
 
 
-def lang(view):
+def user_language(view):
+    ''' Returns the language from settings (a LANG_MAP key) matching the view '''
     global USER_LANGUAGES
     if USER_LANGUAGES is None:
         USER_LANGUAGES = load_active_languages(read_settings())
     for language in USER_LANGUAGES:
         if view.match_selector(view.sel()[0].begin(), 'source.%s' % LANG_MAP[language]):
-            return language.replace('c++', 'cpp').replace('js', 'javascript')
+            return language
     return None
 
 
+def ycmd_filetype(language):
+    return language.replace('c++', 'cpp').replace('js', 'javascript')
+
+
+def lang(view):
+    language = user_language(view)
+    if language is None:
+        return None
+    return ycmd_filetype(language)
+
+
 def get_selected_pos(view):
     try:
         return view.rowcol(view.sel()[0].end())
@@ -164,30 +273,122 @@ def get_file_path(filepath=None, reverse=False):
     return filepath
 
 
-def notify_func(filepath, content, callback, filetype):
-    cli = get_client()
+def find_view(filepath):
+    ''' Returns a view showing filepath (as sent to ycmd), preferring the active one '''
+    view = active_view()
+    if view is not None and get_file_path(view.file_name()) == filepath:
+        return view
+    for window in sublime.windows():
+        for view in window.views():
+            if view.file_name() and get_file_path(view.file_name()) == filepath:
+                return view
+    return None
+
+
+class YcmdDiagnosticsCache(object):
+    ''' Diagnostics of FileReadyToParse responses grouped by file they point to,
+        so files (e.g. headers) can show their problems as soon as they are opened.
+        Keeps the most recently updated max_files files; every entry is tagged
+        with the time the response was received and older responses never
+        replace newer ones.
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        # filepath (as sent to ycmd) -> (time received, diagnostics)
+        self.files = OrderedDict()
+
+    def store(self, grouped, received, max_files):
+        ''' Stores diagnostics grouped by filepath, see group_diagnostics '''
+        with self.lock:
+            for path, file_diagnostics in grouped.items():
+                entry = self.files.pop(path, None)
+                if entry and entry[0] > received:
+                    self.files[path] = entry
+                else:
+                    self.files[path] = (received, file_diagnostics)
+            while len(self.files) > max_files:
+                self.files.popitem(last=False)
+
+    def get(self, path):
+        ''' Returns (time received, diagnostics) of path or None '''
+        with self.lock:
+            return self.files.get(path)
+
+DIAGNOSTICS_CACHE = YcmdDiagnosticsCache()
+
+
+def group_diagnostics(parsed_path, diagnostics, max_per_file, max_files):
+    ''' Groups diagnostics of parsed_path's FileReadyToParse response by file they
+        point to, keeping at most max_per_file of them for each of at most
+        max_files files (parsed_path is always one of them).
+    '''
+    grouped = {parsed_path: []}
+    # runs while the response is read, so settings are not re-read per diagnostic
+    paths = {}
+    for diagnostic in diagnostics:
+        path = diagnostic['location']['filepath']
+        if path not in paths:
+            paths[path] = get_file_path(path)
+        file_diagnostics = grouped.get(paths[path])
+        if file_diagnostics is None:
+            if len(grouped) >= max_files:
+                continue
+            file_diagnostics = grouped[paths[path]] = []
+        if len(file_diagnostics) < max_per_file:
+            file_diagnostics.append(diagnostic)
+    return grouped
+
+
+def parse_file(cli, filepath, content, filetype, priority):
+    ''' Sends FileReadyToParse and returns diagnostics grouped by file, decoding
+        them from the response one by one.
+    '''
+    with closing(http_client.FileDiagnostics(cli, filepath, content, filetype,
+                                             priority)) as diagnostics:
+        settings = read_settings()
+        return group_diagnostics(filepath, diagnostics, settings['diagnostics_max_per_file'],
+                                 settings['diagnostics_cache_max_files'])
+
+
+def fetch_completions(cli, filepath, row, col, content, filetype, priority, max_items=None):
+    ''' Returns at most max_items completions (all if None), the rest of response is not read '''
+    with closing(http_client.SemanticCompletionItems(cli, filepath, row + 1, col + 1,
+                                                     content, filetype, priority)) as items:
+        return list(islice(items, max_items))
+
+
+def store_diagnostics(grouped):
+    DIAGNOSTICS_CACHE.store(grouped, time.time(), read_settings()['diagnostics_cache_max_files'])
+
+
+def notify_func(filepath, content, callback, filetype, priority=http_client.PRIORITY_INTERACTIVE):
+    cli = get_client(filepath=filepath)
     try:
-        data = http_client.PrepareForNewFile(cli, filepath, content, filetype)
+        data = parse_file(cli, filepath, content, filetype, priority)
     except exceptions.UnknownExtraConf as e:
         if sublime.ok_cancel_dialog(str(e)):
             cli.LoadExtraConfFile(e.extra_conf_file)
         else:
             cli.IgnoreExtraConfFile(e.extra_conf_file)
         return
+    except exceptions.RequestShed:
+        # a newer parse of the same file is queued or the server is overloaded
+        return
     except Exception as e:
         print(NOTIFY_ERROR_MSG.format(e))
         return
     if callback:
-        callback(data)
+        callback(data, filepath)
 
 
 def complete_func(filepath, row, col, content, error_cb, data_cb, filetype):
     notify_func(filepath, content, error_cb, filetype)
-    cli = get_client()
+    cli = get_client(filepath=filepath)
     try:
-        data = http_client.SemanticCompletionResults(cli, filepath,
-                                                     row + 1, col + 1,
-                                                     content, filetype)
+        data = fetch_completions(cli, filepath, row, col, content, filetype,
+                                 http_client.PRIORITY_INTERACTIVE,
+                                 read_settings()['completions_max_items'])
     except Exception as e:
         print(COMPLETION_ERROR_MSG.format(e))
         sublime.status_message(COMPLETION_NOT_AVAILABLE_MSG)
@@ -197,7 +398,7 @@ def complete_func(filepath, row, col, content, error_cb, data_cb, filetype):
 
 
 def completer_cmd_func(command, filepath, row, col, content, completer_cb, filetype):
-    cli = get_client()
+    cli = get_client(filepath=filepath)
     try:
         data = cli.SendCompleterCommandRequest(command, filepath, filetype,
                                                row + 1, col + 1, content)
@@ -208,6 +409,269 @@ def completer_cmd_func(command, filepath, row, col, content, completer_cb, filet
     completer_cb(data, command)
 
 
+class YcmdCompletionPrefetcher(object):
+    ''' Speculatively requests semantic completions at the place where the user
+        is about to ask for them, so on_query_completions can answer from memory.
+        Each view keeps at most one entry, anchored at the start of the
+        identifier being completed. Any edit that changes the text before the
+        anchor cancels the in-flight request (its result is discarded) and
+        drops the entry.
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        # view id -> (anchor (row, col), line text before anchor, time, completions)
+        self.entries = {}
+        # view id -> generation of the latest issued prefetch
+        self.generations = {}
+        # view id -> (anchor, line text before anchor) of the in-flight prefetch
+        self.pending = {}
+        self.in_flight = 0
+        self.stats = dict.fromkeys(('issued', 'hits', 'misses', 'cancelled', 'dropped'), 0)
+
+    def schedule(self, view, point, settings=None):
+        if not settings:
+            settings = read_settings()
+        filetype = lang(view)
+        if not settings['prefetch'] or filetype is None or view.is_scratch():
+            return
+        view_id = view.id()
+        anchor = view.rowcol(point)
+        line_prefix = self._line_prefix(view, point)
+        with self.lock:
+            entry = self.entries.get(view_id)
+            if entry and entry[:2] == (anchor, line_prefix) and \
+                    time.time() - entry[2] < settings['prefetch_ttl']:
+                return
+            if self.pending.get(view_id) == (anchor, line_prefix):
+                return
+            if self.in_flight >= settings['prefetch_max_in_flight']:
+                self.stats['dropped'] += 1
+                return
+            self.in_flight += 1
+            self.stats['issued'] += 1
+            generation = self.generations.get(view_id, 0) + 1
+            self.generations[view_id] = generation
+            self.pending[view_id] = (anchor, line_prefix)
+            self.entries.pop(view_id, None)
+        filepath = get_file_path(view.file_name())
+        content = view.substr(sublime.Region(0, view.size()))
+        t = Thread(None, self._fetch, 'PrefetchAsync',
+                   [view_id, generation, anchor, line_prefix, filepath, content, filetype])
+        t.daemon = True
+        t.start()
+
+    def _fetch(self, view_id, generation, anchor, line_prefix, filepath, content, filetype):
+        completions = None
+        try:
+            # not capped: the result is unfiltered and is served for any prefix
+            # typed after the anchor, a truncated list would hide completions
+            completions = fetch_completions(get_client(filepath=filepath), filepath,
+                                            anchor[0], anchor[1], content, filetype,
+                                            http_client.PRIORITY_BACKGROUND)
+        except exceptions.RequestShed:
+            with self.lock:
+                self.stats['dropped'] += 1
+        except Exception as e:
+            print(PREFETCH_ERROR_MSG.format(e))
+        with self.lock:
+            self.in_flight -= 1
+            if self.generations.get(view_id) != generation:
+                return
+            del self.pending[view_id]
+            if completions:
+                self.entries[view_id] = (anchor, line_prefix, time.time(), completions)
+
+    def lookup(self, view, point, settings=None):
+        ''' Returns prefetched completions for identifier starting at point or None '''
+        if not settings:
+            settings = read_settings()
+        if not settings['prefetch']:
+            return None
+        view_id = view.id()
+        key = (view.rowcol(point), self._line_prefix(view, point))
+        with self.lock:
+            entry = self.entries.get(view_id)
+            if entry and entry[:2] == key and \
+                    time.time() - entry[2] < settings['prefetch_ttl']:
+                self.stats['hits'] += 1
+                return entry[3]
+            self.stats['misses'] += 1
+            return None
+
+    def invalidate(self, view):
+        ''' Cancels prefetch of view if the text before its anchor was edited '''
+        view_id = view.id()
+        point = view.sel()[0].begin()
+        row, col = view.rowcol(point)
+        with self.lock:
+            anchored = self.pending.get(view_id)
+            if anchored is None and view_id in self.entries:
+                anchored = self.entries[view_id][:2]
+            if anchored is None:
+                return
+            (anchor_row, anchor_col), line_prefix = anchored
+            if row == anchor_row and col >= anchor_col and \
+                    self._line_prefix(view, view.text_point(row, anchor_col)) == line_prefix:
+                return
+        self.cancel(view_id)
+
+    def cancel(self, view_id):
+        with self.lock:
+            if view_id in self.pending:
+                del self.pending[view_id]
+                self.stats['cancelled'] += 1
+            self.generations[view_id] = self.generations.get(view_id, 0) + 1
+            self.entries.pop(view_id, None)
+
+    def forget(self, view_id):
+        self.cancel(view_id)
+        with self.lock:
+            self.generations.pop(view_id, None)
+
+    def _line_prefix(self, view, point):
+        return view.substr(sublime.Region(view.line(point).begin(), point))
+
+PREFETCHER = YcmdCompletionPrefetcher()
+
+
+def at_trigger(view, point):
+    ''' Checks if text before point ends with a member access trigger of view's language '''
+    triggers = TRIGGER_MAP.get(user_language(view), ['.'])
+    longest = max(len(trigger) for trigger in triggers)
+    text = view.substr(sublime.Region(max(0, point - longest), point))
+    return any(text.endswith(trigger) for trigger in triggers)
+
+
+def at_identifier_start(view, point):
+    ''' Checks if an identifier would start at point (not inside a word, comment or string) '''
+    before = view.substr(point - 1) if point > 0 else ''
+    after = view.substr(point)
+    if IDENTIFIER_CHAR.match(before) or IDENTIFIER_CHAR.match(after):
+        return False
+    return not view.match_selector(point, 'comment, string')
+
+
+class YcmdProjectPreparser(object):
+    ''' Sends FileReadyToParse for every source file of the project in background,
+        so ycmd has translation units ready before the files are opened.
+        Project folders are walked in background too, then files are handed
+        to a small pool of workers, the pool as a whole is limited to
+        files_per_second, and every worker waits while interactive requests
+        (completions, commands) are in flight.
+    '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.cancelled = Event()
+        self.collecting = False
+        self.files = []
+        self.total = 0
+        self.done = 0
+        self.next_slot = 0
+
+    def is_running(self):
+        return not self.cancelled.is_set() and (self.collecting or self.done < self.total)
+
+    def start(self, window, settings=None):
+        if not settings:
+            settings = read_settings()
+        self.cancel()
+        # the order of languages decides the filetype of shared extensions (.h)
+        active = load_active_languages(settings)
+        languages = [language for language in settings['languages'] if language in active]
+        with self.lock:
+            self.cancelled = Event()
+            self.collecting = True
+            self.files = []
+            self.total = 0
+            self.done = 0
+        t = Thread(None, self._collect, 'PreparseCollectAsync',
+                   [self.cancelled, window.folders(), languages, settings])
+        t.daemon = True
+        t.start()
+
+    def _collect(self, cancelled, folders, languages, settings):
+        files = self.collect_files(folders, languages, settings['preparse_max_files'], cancelled)
+        with self.lock:
+            if cancelled.is_set():
+                return
+            self.collecting = False
+            self.files = files
+            self.total = len(files)
+            self.next_slot = time.time()
+        if not files:
+            print_status(PREPARSE_NOTHING_MSG)
+            return
+        interval = 1.0 / max(settings['preparse_files_per_second'], 0.01)
+        for i in range(min(max(settings['preparse_workers'], 1), len(files))):
+            t = Thread(None, self._work, 'PreparseAsync', [cancelled, interval, settings])
+            t.daemon = True
+            t.start()
+
+    def cancel(self):
+        if self.is_running():
+            print_status(PREPARSE_CANCELLED_TEMPLATE.format(done=self.done, total=self.total))
+        self.cancelled.set()
+
+    def collect_files(self, folders, languages, max_files, cancelled):
+        filetypes = {}
+        for language in languages:
+            for extension in EXTENSION_MAP.get(language, []):
+                filetypes.setdefault(extension, ycmd_filetype(language))
+        files = []
+        for folder in folders:
+            for root, dirs, names in os.walk(folder):
+                if cancelled.is_set():
+                    return []
+                dirs[:] = [d for d in dirs if not d.startswith('.')]
+                for name in sorted(names):
+                    filetype = filetypes.get(os.path.splitext(name)[1].lower())
+                    if filetype:
+                        files.append((os.path.join(root, name), filetype))
+                        if len(files) >= max_files:
+                            return files
+        return files
+
+    def _next_file(self, cancelled, interval):
+        ''' Returns the next file to parse and the time it may be sent at '''
+        with self.lock:
+            if cancelled.is_set() or not self.files:
+                return None, None
+            slot = self.next_slot = max(self.next_slot, time.time()) + interval
+            return self.files.pop(0), slot - interval
+
+    def _work(self, cancelled, interval, settings):
+        while True:
+            while not http_client.WaitForInteractiveIdle(0.5):
+                if cancelled.is_set():
+                    return
+            item, slot = self._next_file(cancelled, interval)
+            if item is None:
+                return
+            if cancelled.wait(max(slot - time.time(), 0)):
+                return
+            path, filetype = item
+            try:
+                with open(path, encoding='utf-8', errors='replace') as source:
+                    content = source.read()
+                filepath = get_file_path(path)
+                store_diagnostics(parse_file(get_client(settings, filepath), filepath,
+                                             content, filetype, http_client.PRIORITY_BACKGROUND))
+            except Exception as e:
+                print(PREPARSE_ERROR_MSG.format(e))
+            if cancelled.is_set():
+                return
+            with self.lock:
+                self.done += 1
+                done = self.done
+            sublime.status_message(PREPARSE_PROGRESS_TEMPLATE.format(done=done, total=self.total))
+            if done == self.total:
+                print_status(PREPARSE_PROGRESS_TEMPLATE.format(done=done, total=self.total))
+
+PREPARSER = YcmdProjectPreparser()
+
+
 class YcmdRestartServerCommand(sublime_plugin.WindowCommand):
     def run(self):
         settings = read_settings()
@@ -218,7 +682,33 @@ class YcmdRestartServerCommand(sublime_plugin.WindowCommand):
 class YcmdReloadSettingsCommand(sublime_plugin.WindowCommand):
     def run(self):
         global USER_LANGUAGES
-        USER_LANGUAGES = load_active_languages(read_settings())
+        settings = read_settings()
+        USER_LANGUAGES = load_active_languages(settings)
+        configure_tracing(settings)
+        configure_limiters(settings)
+
+
+class YcmdPreparseProjectCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        PREPARSER.start(self.window)
+
+
+class YcmdCancelPreparseCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        PREPARSER.cancel()
+
+    def is_enabled(self):
+        return PREPARSER.is_running()
+
+
+class YcmdShowStatsCommand(sublime_plugin.WindowCommand):
+    def run(self):
+        print_status(PREFETCH_STATS_TEMPLATE.format(**PREFETCHER.stats))
+        for location, stats in http_client.LimiterStats():
+            print(LIMITER_STATS_TEMPLATE.format(location=location, **stats))
+        if ROUTER:
+            for location, available in ROUTER.Status():
+                print(ROUTER_STATUS_TEMPLATE.format(location, 'up' if available else 'down'))
 
 
 class YcmdCreateHmacPairCommand(sublime_plugin.WindowCommand):
@@ -237,6 +727,12 @@ class YcmdCompletionEventListener(sublime_plugin.EventListener):
     ready_from_defer = False
     view_cache = dict()
     view_line = dict()
+    # view id -> receive time of diagnostics currently shown in view
+    view_diagnostics_time = dict()
+    # view id -> number of the latest highlight_problems call, older ones stop
+    highlight_generations = dict()
+    # view id -> number of region keys drawn by highlight_problems steps
+    highlight_chunks = dict()
 
     def on_selection_modified_async(self, view):
         if view.id() == ERROR_PANEL.id():
@@ -245,18 +741,52 @@ class YcmdCompletionEventListener(sublime_plugin.EventListener):
         if lang(view) is None or view.is_scratch():
             return
         self.update_statusbar(view)
+        self.schedule_idle_prefetch(view)
+
+    def on_modified_async(self, view):
+        if lang(view) is None or view.is_scratch():
+            return
+        point = view.sel()[0].end()
+        if at_trigger(view, point):
+            PREFETCHER.schedule(view, point)
+        else:
+            PREFETCHER.invalidate(view)
+
+    def schedule_idle_prefetch(self, view):
+        settings = read_settings()
+        sel = view.sel()
+        if not settings['prefetch'] or len(sel) != 1 or not sel[0].empty():
+            return
+        point = sel[0].end()
+        if not at_identifier_start(view, point):
+            return
+        change_count = view.change_count()
+
+        def prefetch_if_idle():
+            sel = view.sel()
+            if len(sel) == 1 and sel[0].empty() and sel[0].end() == point and \
+                    view.change_count() == change_count:
+                PREFETCHER.schedule(view, point, settings)
+        sublime.set_timeout_async(prefetch_if_idle, settings['prefetch_idle_delay'])
 
     def on_load_async(self, view):
         '''Called when the file is finished loading'''
         filetype = lang(view)
         if filetype is '' or view.is_scratch():
             return
-        filepath = get_file_path()
+        filepath = get_file_path(view.file_name())
+        self.apply_cached_diagnostics(view)
         content = view.substr(sublime.Region(0, view.size()))
-        t = Thread(None, notify_func, 'NotifyAsync', [filepath, content, self._on_errors, filetype])
+        t = Thread(None, notify_func, 'NotifyAsync', [filepath, content, self._on_errors, filetype,
+                                                      http_client.PRIORITY_BACKGROUND])
         t.daemon = True
         t.start()
 
+    def on_load_project_async(self, window):
+        settings = read_settings()
+        if settings['preparse_on_project_open']:
+            PREPARSER.start(window, settings)
+
     def on_post_save_async(self, view):
         if lang(view) is None or view.is_scratch():
             return
@@ -268,11 +798,16 @@ class YcmdCompletionEventListener(sublime_plugin.EventListener):
             del self.view_line[view_id]
         if view_id in self.view_cache:
             del self.view_cache[view_id]
+        self.view_diagnostics_time.pop(view_id, None)
+        self.highlight_generations.pop(view_id, None)
+        self.highlight_chunks.pop(view_id, None)
+        PREFETCHER.forget(view_id)
 
     def on_activated_async(self, view):
         if lang(view) is None or view.is_scratch():
             return
-        ERROR_PANEL.update(self.view_cache)
+        if not self.apply_cached_diagnostics(view):
+            ERROR_PANEL.update(self.view_cache)
 
     def on_query_completions(self, view, prefix, locations):
         '''Sublime Text autocompletion event handler'''
@@ -288,6 +823,11 @@ class YcmdCompletionEventListener(sublime_plugin.EventListener):
             self.ready_from_defer = False
             return (cpl, sublime.INHIBIT_WORD_COMPLETIONS | sublime.INHIBIT_EXPLICIT_COMPLETIONS)
 
+        prefetched = PREFETCHER.lookup(view, locations[0] - len(prefix))
+        if prefetched:
+            return (list(self.generate_completion_items(prefetched)),
+                    sublime.INHIBIT_WORD_COMPLETIONS | sublime.INHIBIT_EXPLICIT_COMPLETIONS)
+
         filepath = get_file_path()
         row, col = view.rowcol(locations[0])
         content = view.substr(sublime.Region(0, view.size()))
@@ -296,13 +836,8 @@ class YcmdCompletionEventListener(sublime_plugin.EventListener):
         t.daemon = True
         t.start()
 
-    def _complete(self, data):
-        try:
-            jsonResp = loads(data)
-        except:
-            print(NOTIFY_ERROR_MSG.format("json '{}'".format(data)))
-            return
-        proposals = list(self.generate_completion_items(jsonResp['completions']))
+    def _complete(self, completions):
+        proposals = list(self.generate_completion_items(completions))
 
         if proposals:
             active_view().run_command("hide_auto_complete")
@@ -319,18 +854,24 @@ class YcmdCompletionEventListener(sublime_plugin.EventListener):
             'auto_complete_commit_on_tab': True,
         })
 
-    def _on_errors(self, data):
-        try:
-            data = loads(data)
-        except:
-            print(NOTIFY_ERROR_MSG.format("json '{}'".format(data)))
-            return
-        filepath = get_file_path()
-        self.highlight_problems(active_view(),
-                                [_ for _ in data
-                                    if get_file_path(_['location']['filepath']) == filepath])
-        self.update_statusbar(active_view(), force=True)
-        ERROR_PANEL.update(self.view_cache)
+    def _on_errors(self, diagnostics, filepath):
+        store_diagnostics(diagnostics)
+        view = find_view(filepath)
+        if view is not None:
+            self.apply_cached_diagnostics(view)
+
+    def apply_cached_diagnostics(self, view):
+        ''' Shows cached diagnostics of view's file, if they are newer than shown ones '''
+        entry = DIAGNOSTICS_CACHE.get(get_file_path(view.file_name()))
+        if entry is None:
+            return False
+        received, diagnostics = entry
+        view_id = view.id()
+        if self.view_diagnostics_time.get(view_id, 0) >= received:
+            return False
+        self.view_diagnostics_time[view_id] = received
+        self.highlight_problems(view, diagnostics)
+        return True
 
     def update_statusbar(self, view, force=False):
         row, col = get_selected_pos(view)
@@ -353,24 +894,92 @@ class YcmdCompletionEventListener(sublime_plugin.EventListener):
         view.erase_status('clang-code-errors')
 
     def highlight_problems(self, view, problems):
-        view.erase_regions('clang-code-errors')
+        ''' Shows problems in the visible part of view at once, then the rest
+            (nearest to the visible part first) in HIGHLIGHT_SLICE long steps on
+            the main thread, each step drawing its lines under its own region key.
+            Problems are printed to console after the visible ones are drawn.
+            A newer call for the same view stops the older one.
+        '''
         view_id = view.id()
+        generation = self.highlight_generations.get(view_id, 0) + 1
+        self.highlight_generations[view_id] = generation
+        visible = view.visible_region()
+        first_row, last_row = view.rowcol(visible.begin())[0], view.rowcol(visible.end())[0]
+        center_row = (first_row + last_row) / 2
+        lines = OrderedDict()
+        for problem in sorted(problems, key=lambda problem: (
+                not first_row <= problem['location']['line_num'] - 1 <= last_row,
+                abs(problem['location']['line_num'] - 1 - center_row))):
+            lines.setdefault(problem['location']['line_num'] - 1, []).append(problem)
+        pending = list(lines.items())
+        visible_count = 0
+        while visible_count < len(pending) and first_row <= pending[visible_count][0] <= last_row:
+            visible_count += 1
+
         view_cache = {}
-        regions = []
-        for problem in problems:
-            lineno = problem['location']['line_num']
-            colno = problem['location']['column_num']
-            line_regions = view_cache.setdefault(lineno - 1, {})
-            message = ERROR_MESSAGE_TEMPLATE.format(**problem)
-            print(PRINT_ERROR_MESSAGE_TEMPLATE.format(message, lineno, colno))
-            region = view.word(view.text_point(lineno - 1, colno - 1))
-            regions.append(region)
-            line_regions[(region.a, region.b)] = message
         self.view_cache[view_id] = view_cache
+        self._draw_problems(view, 'clang-code-errors',
+                            self._add_problems(view, pending[:visible_count], view_cache))
+        self.update_statusbar(view, force=True)
+        # reversed, lines are popped from the end
+        pending = pending[visible_count:][::-1]
+        # drawing counts against the slice too, so lines are added for what is left
+        budget = [HIGHLIGHT_SLICE]
+
+        def apply_slice():
+            if self.highlight_generations.get(view_id) != generation:
+                return
+            start = time.time()
+            regions = []
+            while pending and time.time() - start < budget[0]:
+                regions.extend(self._add_problems(view, [pending.pop()], view_cache))
+            chunk = self.highlight_chunks.get(view_id, 0) + 1
+            self.highlight_chunks[view_id] = chunk
+            draw_start = time.time()
+            self._draw_problems(view, 'clang-code-errors-{}'.format(chunk), regions)
+            budget[0] = max(HIGHLIGHT_SLICE - (time.time() - draw_start), HIGHLIGHT_SLICE / 4)
+            if pending:
+                sublime.set_timeout(apply_slice, 0)
+            else:
+                self.update_statusbar(view, force=True)
+                ERROR_PANEL.update(self.view_cache)
+
+        def start_slices():
+            if self.highlight_generations.get(view_id) != generation:
+                return
+            # regions of the previous problems outside of the visible part
+            for chunk in range(1, self.highlight_chunks.get(view_id, 0) + 1):
+                view.erase_regions('clang-code-errors-{}'.format(chunk))
+            self.highlight_chunks[view_id] = 0
+            if pending:
+                apply_slice()
+            else:
+                ERROR_PANEL.update(self.view_cache)
+        sublime.set_timeout(start_slices, 0)
+        # printed last, thousands of console lines would hold back visible problems
+        for problem in problems:
+            print(PRINT_ERROR_MESSAGE_TEMPLATE.format(ERROR_MESSAGE_TEMPLATE.format(**problem),
+                                                      problem['location']['line_num'],
+                                                      problem['location']['column_num']))
+
+    def _add_problems(self, view, lines, view_cache):
+        ''' Adds problems grouped by line to view_cache, returns their regions '''
+        regions = []
+        for row, problems in lines:
+            # filled before it is published, update_statusbar reads it from other threads
+            line_regions = {}
+            for problem in problems:
+                colno = problem['location']['column_num']
+                region = view.word(view.text_point(row, colno - 1))
+                regions.append(region)
+                line_regions[(region.a, region.b)] = ERROR_MESSAGE_TEMPLATE.format(**problem)
+            view_cache[row] = line_regions
+        return regions
+
+    def _draw_problems(self, view, key, regions):
         style = (sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE |
                  sublime.DRAW_SQUIGGLY_UNDERLINE)
-        view.add_regions(
-            'clang-code-errors', regions, 'invalid', ERROR_MARKER_IMG, style)
+        view.add_regions(key, regions, 'invalid', ERROR_MARKER_IMG, style)
 
     def generate_completion_items(self, completions):
         for completion in completions:
@@ -25,3 +25,58 @@ LANG_MAP = {
     'perl6': 'perl', # Sublime doesn't treat perl 6 as different
 }
 
+
+# Member access sequences after which a semantic completion is worth
+# requesting ahead of time, keyed like LANG_MAP
+TRIGGER_MAP = {
+    'c': ['.', '->'],
+    'objc': ['.', '->'],
+    'objc++': ['.', '->', '::'],
+    'ocaml': ['.'],
+    'c++': ['.', '->', '::'],
+    'perl': ['->', '::'],
+    'php': ['->', '::'],
+    'cs': ['.'],
+    'java': ['.'],
+    'js': ['.'],
+    'd': ['.'],
+    'python': ['.'],
+    'go': ['.'],
+    'erlang': [':'],
+    'ruby': ['.', '::'],
+    'rust': ['.', '::'],
+    'lua': ['.', ':'],
+    'elixir': ['.'],
+    'cpp': ['.', '->', '::'],
+    'javascript': ['.'],
+    'typescript': ['.'],
+    'vb': ['.'],
+    'perl6': ['.', '::'],
+}
+
+# Source file extensions of each language, keyed like LANG_MAP
+EXTENSION_MAP = {
+    'c': ['.c', '.h'],
+    'objc': ['.m', '.h'],
+    'objc++': ['.mm', '.h'],
+    'ocaml': ['.ml', '.mli'],
+    'c++': ['.cpp', '.cc', '.cxx', '.c++', '.hpp', '.hh', '.hxx', '.h'],
+    'perl': ['.pl', '.pm'],
+    'php': ['.php'],
+    'cs': ['.cs'],
+    'java': ['.java'],
+    'js': ['.js'],
+    'd': ['.d'],
+    'python': ['.py'],
+    'go': ['.go'],
+    'erlang': ['.erl', '.hrl'],
+    'ruby': ['.rb'],
+    'rust': ['.rs'],
+    'lua': ['.lua'],
+    'elixir': ['.ex', '.exs'],
+    'cpp': ['.cpp', '.cc', '.cxx', '.c++', '.hpp', '.hh', '.hxx', '.h'],
+    'javascript': ['.js'],
+    'typescript': ['.ts'],
+    'vb': ['.vb'],
+    'perl6': ['.p6', '.pm6', '.pl6'],
+}
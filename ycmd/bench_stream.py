@@ -0,0 +1,124 @@
+# -*- coding: utf8 -*-
+#!/usr/bin/env python
+'''Compares peak memory and time of the full-buffer response decode with the
+streaming one (json_stream) on synthetic ycmd responses.
+
+Run from the plugin directory:
+    python -m ycmd.bench_stream --items 200000 --cap 1000
+'''
+
+from .json_stream import IterJsonItems
+from itertools import islice
+import argparse
+import json
+import time
+import tracemalloc
+
+
+class SyntheticResponse(object):
+    ''' Produces a JSON response chunk by chunk, like a socket would, so the
+        payload itself is never held in memory as a whole.
+    '''
+
+    def __init__(self, prefix, item, count, suffix):
+        self._parts = self._Parts(prefix, item, count, suffix)
+        self._pending = b''
+
+    def _Parts(self, prefix, item, count, suffix):
+        yield prefix.encode('utf-8')
+        for i in range(count):
+            yield ((',' if i else '') + item(i)).encode('utf-8')
+        yield suffix.encode('utf-8')
+
+    def read(self, size=-1):
+        if size < 0:
+            return self._pending + b''.join(self._parts)
+        while len(self._pending) < size:
+            part = next(self._parts, None)
+            if part is None:
+                break
+            self._pending += part
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+def CompletionsResponse(count):
+    item = lambda i: json.dumps({'insertion_text': 'member_{}'.format(i),
+                                 'extra_menu_info': 'std::vector<int>',
+                                 'detailed_info': 'std::vector<int> member_{}'.format(i),
+                                 'kind': 'MEMBER'})
+    return SyntheticResponse('{"completions": [', item, count,
+                             '], "completion_start_column": 5, "errors": []}')
+
+
+def DiagnosticsResponse(count):
+    item = lambda i: json.dumps({'location': {'filepath': '/src/header_{}.h'.format(i % 50),
+                                              'line_num': i + 1, 'column_num': 3},
+                                 'location_extent': {'start': {'line_num': i + 1,
+                                                               'column_num': 3},
+                                                     'end': {'line_num': i + 1,
+                                                             'column_num': 9}},
+                                 'kind': 'ERROR',
+                                 'text': 'use of undeclared identifier'})
+    return SyntheticResponse('[', item, count, ']')
+
+
+def EmptyDiagnosticsResponse(count):
+    # ycmd replies {} to events without diagnostics
+    return SyntheticResponse('{', None, 0, '}')
+
+
+def FullBufferDecode(response, member, cap):
+    data = json.loads(response.read().decode('utf-8'))
+    items = data[member] if member else data
+    if isinstance(items, dict):
+        items = []
+    return len(items[:cap] if cap else items)
+
+
+def StreamingDecode(response, member, cap):
+    # without a cap items are only looked at, like diagnostics of other files
+    items = IterJsonItems(response, member)
+    if cap:
+        return len(list(islice(items, cap)))
+    return sum(1 for _ in items)
+
+
+def Measure(decode, response, member, cap):
+    ''' Returns items decoded, time and peak memory (measured in a second run,
+        as tracing allocations slows decoding down)
+    '''
+    start = time.time()
+    count = decode(response(), member, cap)
+    duration = time.time() - start
+    tracemalloc.start()
+    decode(response(), member, cap)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, duration, peak
+
+
+def Main():
+    parser = argparse.ArgumentParser(description='Benchmark streaming response decoding')
+    parser.add_argument('--items', type=int, default=100000,
+                        help='completions/diagnostics in the response')
+    parser.add_argument('--cap', type=int, default=1000,
+                        help='items the consumer needs, 0 for all')
+    args = parser.parse_args()
+
+    print('{:<12} {:<12} {:>6} {:>9} {:>10} {:>12}'.format(
+        'response', 'decode', 'cap', 'items', 'time ms', 'peak KiB'))
+    for name, response, member in (('completions', CompletionsResponse, 'completions'),
+                                   ('diagnostics', DiagnosticsResponse, None),
+                                   ('no errors', EmptyDiagnosticsResponse, None)):
+        for cap in sorted({0, args.cap}):
+            for decode_name, decode in (('full-buffer', FullBufferDecode),
+                                        ('streaming', StreamingDecode)):
+                count, duration, peak = Measure(decode, lambda: response(args.items),
+                                                member, cap)
+                print('{:<12} {:<12} {:>6} {:>9} {:>10.1f} {:>12.1f}'.format(
+                    name, decode_name, cap or 'all', count, duration * 1000, peak / 1024.0))
+
+
+if __name__ == '__main__':
+    Main()
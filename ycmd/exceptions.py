@@ -5,3 +5,10 @@ class UnknownExtraConf(Exception):
         message = "YcmdCompletion found {0}. Load?".format(extra_conf_file)
         super(UnknownExtraConf, self).__init__(message)
         self.extra_conf_file = extra_conf_file
+
+
+class RequestShed(Exception):
+    def __init__(self, reason):
+        message = "Request to ycmd dropped: {0}".format(reason)
+        super(RequestShed, self).__init__(message)
+        self.reason = reason
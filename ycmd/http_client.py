@@ -4,10 +4,13 @@
 from base64 import b64encode
 from urllib.request import Request, urlopen
 from urllib.error import HTTPError
+from .limiter import AdaptiveLimiter
 from .wrapper_utils import ToUtf8Json
 from .ycmd_events import EventEnum
 from .exceptions import UnknownExtraConf
-import collections
+from .json_stream import IterJsonItems
+import collections.abc
+import contextlib
 import hmac
 import hashlib
 import json
@@ -16,10 +19,12 @@ import socket
 import subprocess
 import tempfile
 import threading
+import time
 
 
 HMAC_HEADER = 'X-Ycm-Hmac'
 HMAC_SECRET_LENGTH = 16
+HEALTH_CHECK_TIMEOUT = 2.0
 
 DEFINED_SUBCOMMANDS_HANDLER = '/defined_subcommands'
 CODE_COMPLETIONS_HANDLER = '/completions'
@@ -27,8 +32,29 @@ COMPLETER_COMMANDS_HANDLER = '/run_completer_command'
 EVENT_HANDLER = '/event_notification'
 EXTRA_CONF_HANDLER = '/load_extra_conf_file'
 IGNORE_EXTRA_CONF_HANDLER = '/ignore_extra_conf_file'
+HEALTHY_HANDLER = '/healthy'
 DIR_OF_THIS_SCRIPT = os.path.dirname(os.path.abspath(__file__))
 
+# Interactive requests are the ones user waits for, background ones
+# (bulk parsing, speculative requests) should yield to them
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BACKGROUND = 'background'
+
+_INTERACTIVE_IDLE = threading.Condition()
+_INTERACTIVE_IN_FLIGHT = 0
+
+# trace.TraceRecorder receiving every request, if tracing is enabled
+_TRACE_RECORDER = None
+
+# server location -> AdaptiveLimiter shared by all clients of that server
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+_LIMITER_OPTIONS = {}
+
+# Responses meaning that the server is overloaded
+BACKPRESSURE_CODES = (429, 503)
+OVERLOAD_CODES = (502, 504)
+
 
 class YcmdClient(object):
 
@@ -66,23 +92,30 @@ class YcmdClient(object):
         hmac_secret = os.urandom(HMAC_SECRET_LENGTH)
         return b64encode(hmac_secret), hmac_secret
 
-    def PostToHandler(self, handler, data):
-        return self._CallHttp('post', handler, data)
+    def PostToHandler(self, handler, data, priority=PRIORITY_INTERACTIVE):
+        return self._CallHttp('post', handler, data, priority)
+
+    def StreamFromHandler(self, handler, data, priority=PRIORITY_INTERACTIVE, member=None):
+        return self._StreamHttp('post', handler, data, priority, member)
 
     def GetFromHandler(self, handler):
-        return self._CallHttp('get', handler)
+        return self._CallHttp('get', handler, '')
 
     def SendDefinedSubcommandsRequest(self, completer_target):
         request_json = BuildRequestData(completer_target=completer_target)
         self.PostToHandler(DEFINED_SUBCOMMANDS_HANDLER, request_json)
 
-    def SendCodeCompletionRequest(self, filepath, filetype, line_num, column_num, contents):
+    def SendCodeCompletionRequest(self, filepath, filetype, line_num, column_num, contents,
+                                  priority=PRIORITY_INTERACTIVE, stream=False):
         request_json = BuildRequestData(filepath=filepath,
                                         filetype=filetype,
                                         line_num=line_num,
                                         column_num=column_num,
                                         contents=contents)
-        return self.PostToHandler(CODE_COMPLETIONS_HANDLER, request_json)
+        if stream:
+            return self.StreamFromHandler(CODE_COMPLETIONS_HANDLER, request_json, priority,
+                                          'completions')
+        return self.PostToHandler(CODE_COMPLETIONS_HANDLER, request_json, priority)
 
     def SendCompleterCommandRequest(self, command, filepath, filetype, line_num, column_num, contents):
         request_json = BuildRequestData(filepath=filepath,
@@ -100,7 +133,9 @@ class YcmdClient(object):
                               line_num=1,  # just placeholder values
                               column_num=1,
                               extra_data=None,
-                              contents=''):
+                              contents='',
+                              priority=PRIORITY_INTERACTIVE,
+                              stream=False):
         request_json = BuildRequestData(filepath=filepath,
                                         filetype=filetype,
                                         line_num=line_num,
@@ -109,7 +144,9 @@ class YcmdClient(object):
         if extra_data:
             request_json.update(extra_data)
         request_json['event_name'] = event_enum
-        return self.PostToHandler(EVENT_HANDLER, request_json)
+        if stream:
+            return self.StreamFromHandler(EVENT_HANDLER, request_json, priority)
+        return self.PostToHandler(EVENT_HANDLER, request_json, priority)
 
     def LoadExtraConfFile(self, extra_conf_filename):
         request_json = {'filepath': extra_conf_filename}
@@ -119,6 +156,14 @@ class YcmdClient(object):
         request_json = {'filepath': extra_conf_filename}
         self.PostToHandler(IGNORE_EXTRA_CONF_HANDLER, request_json)
 
+    def IsHealthy(self, timeout=HEALTH_CHECK_TIMEOUT):
+        # goes around the limiter, health checks must not queue behind requests
+        try:
+            return json.loads(self._DoCallHttp('get', HEALTHY_HANDLER, '', PRIORITY_BACKGROUND,
+                                               None, timeout)) is True
+        except Exception:
+            return False
+
     def _HmacForRequest(self, method, path, body):
         return b64encode(CreateRequestHmac(method, path, body,
                                            self._hmac_secret))
@@ -126,24 +171,103 @@ class YcmdClient(object):
     def _BuildUri(self, handler):
         return self._server_location + handler
 
-    def _CallHttp(self, method, handler, data=None):
+    def _CallHttp(self, method, handler, data=None, priority=PRIORITY_INTERACTIVE):
+        with self._LimitedHttp(handler, data, priority) as slot:
+            return self._DoCallHttp(method, handler, data, priority, slot)
+
+    def _StreamHttp(self, method, handler, data=None, priority=PRIORITY_INTERACTIVE,
+                    member=None):
+        ''' Yields items of the JSON array in the response (or in its member) while
+            they are decoded from the socket. The request holds its limiter slot
+            until the generator is exhausted or closed.
+        '''
+        with self._LimitedHttp(handler, data, priority) as slot:
+            with self._OpenHttp(method, handler, data, priority, slot) as response:
+                for item in IterJsonItems(response, member):
+                    yield item
+
+    @contextlib.contextmanager
+    def _LimitedHttp(self, handler, data, priority):
+        interactive = priority == PRIORITY_INTERACTIVE
+        limiter = GetLimiter(self._server_location)
+        key = None
+        if not interactive and isinstance(data, collections.abc.Mapping):
+            key = (handler, data.get('filepath'))
+        if interactive:
+            _TrackInteractiveRequest(1)
+        try:
+            limiter.Acquire(interactive, key)
+            slot = LimiterSlot(limiter)
+            error = False
+            retry_after = None
+            try:
+                yield slot
+            except HTTPError as err:
+                if err.code in BACKPRESSURE_CODES:
+                    retry_after = ParseRetryAfter(err.headers.get('Retry-After'))
+                error = err.code in OVERLOAD_CODES
+                raise
+            except OSError:
+                error = True
+                raise
+            finally:
+                # parse time depends on the file more than on server load
+                latency = slot.Latency() if handler != EVENT_HANDLER else None
+                limiter.Release(latency, error, retry_after)
+        finally:
+            if interactive:
+                _TrackInteractiveRequest(-1)
+
+    def _DoCallHttp(self, method, handler, data, priority, slot, timeout=None):
+        with self._OpenHttp(method, handler, data, priority, slot, timeout) as response:
+            return response.read().decode('utf-8')
+
+    @contextlib.contextmanager
+    def _OpenHttp(self, method, handler, data, priority, slot, timeout=None):
         method = method.upper()
+        request_data = data
         req = Request(self._BuildUri(handler), method=method)
-        if isinstance(data, collections.Mapping):
+        if isinstance(data, collections.abc.Mapping):
             req.add_header('content-type', 'application/json')
             data = ToUtf8Json(data)
         req.add_header(
             HMAC_HEADER, self._HmacForRequest(method, handler, data))
         req.data = bytes(data, 'utf-8')
+        recorder = _TRACE_RECORDER
+        start = time.time()
+        status = 200
+        response = None
         try:
-            readData = urlopen(req).read().decode('utf-8')
-            return readData
+            response = CountingReader(urlopen(req, timeout=timeout) if timeout else urlopen(req))
+            if slot:
+                slot.Responded()
+            yield response
         except HTTPError as err:
+            status = err.code
             if err.code == 500:
                 responseAsJson = json.loads(err.read().decode('utf-8'))
                 if responseAsJson['exception']['TYPE'] == "UnknownExtraConf":
                     raise UnknownExtraConf(responseAsJson['exception']['extra_conf_file'])
             raise err
+        except Exception as err:
+            status = type(err).__name__
+            raise
+        finally:
+            if response:
+                response.close()
+            if recorder:
+                self._Record(recorder, method, handler, request_data, len(req.data),
+                             response.size if response else 0, start, time.time() - start,
+                             status, priority, slot.limiter.Stats() if slot else None)
+
+    def _Record(self, recorder, *args):
+        # tracing is optional, it must never fail the request itself
+        try:
+            recorder.Record(*args)
+        except Exception as err:
+            if _TRACE_RECORDER is recorder:
+                SetTraceRecorder(None)
+                print('[Ycmd][Trace] Recording disabled: {}'.format(err))
 
     def IsAlive(self):
         returncode = self._popen_handle.poll()
@@ -155,6 +279,96 @@ class YcmdClient(object):
             self._popen_handle.terminate()
 
 
+class LimiterSlot(object):
+    ''' Slot a request holds in its server's limiter. Latency is measured until
+        the response headers arrive: reading and decoding the body is not
+        server time.
+    '''
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self._start = time.time()
+        self._responded = None
+
+    def Responded(self):
+        self._responded = time.time()
+
+    def Latency(self):
+        return (self._responded or time.time()) - self._start
+
+
+class CountingReader(object):
+    ''' Wraps HTTP response to count bytes read from it '''
+
+    def __init__(self, response):
+        self._response = response
+        self.size = 0
+
+    def read(self, size=None):
+        # HTTPResponse.read() before Python 3.10 does not accept -1
+        data = self._response.read() if size is None else self._response.read(size)
+        self.size += len(data)
+        return data
+
+    def close(self):
+        self._response.close()
+
+
+def GetLimiter(server_location):
+    with _LIMITERS_LOCK:
+        limiter = _LIMITERS.get(server_location)
+        if limiter is None:
+            limiter = _LIMITERS[server_location] = AdaptiveLimiter(**_LIMITER_OPTIONS)
+        return limiter
+
+
+def ConfigureLimiters(min_limit, max_limit, latency_target, max_queued):
+    with _LIMITERS_LOCK:
+        _LIMITER_OPTIONS.update(min_limit=min_limit, max_limit=max_limit,
+                                latency_target=latency_target, max_queued=max_queued)
+        for limiter in _LIMITERS.values():
+            limiter.Configure(min_limit, max_limit, latency_target, max_queued)
+
+
+def LimiterStats():
+    with _LIMITERS_LOCK:
+        limiters = list(_LIMITERS.items())
+    return [(location, limiter.Stats()) for location, limiter in sorted(limiters)]
+
+
+def ParseRetryAfter(value, default=1.0):
+    try:
+        return max(float(value), 0)
+    except (TypeError, ValueError):
+        # HTTP-date form is not worth parsing here
+        return default
+
+
+def SetTraceRecorder(recorder):
+    global _TRACE_RECORDER
+    _TRACE_RECORDER = recorder
+
+
+def _TrackInteractiveRequest(delta):
+    global _INTERACTIVE_IN_FLIGHT
+    with _INTERACTIVE_IDLE:
+        _INTERACTIVE_IN_FLIGHT += delta
+        if not _INTERACTIVE_IN_FLIGHT:
+            _INTERACTIVE_IDLE.notify_all()
+
+
+def InteractiveRequestsInFlight():
+    return _INTERACTIVE_IN_FLIGHT
+
+
+def WaitForInteractiveIdle(timeout=None):
+    ''' Blocks while interactive requests are in flight.
+        Returns False if they are still running after timeout.
+    '''
+    with _INTERACTIVE_IDLE:
+        return _INTERACTIVE_IDLE.wait_for(lambda: not _INTERACTIVE_IN_FLIGHT, timeout)
+
+
 def CreateRequestHmac(method, path, body, hmac_secret):
     method = bytes(method, 'utf-8')
     path = bytes(path, 'utf-8')
@@ -201,21 +415,48 @@ def BuildRequestData(filepath='',
     return data
 
 
-def PrepareForNewFile(server, path, contents, filetype):
+def PrepareForNewFile(server, path, contents, filetype, priority=PRIORITY_INTERACTIVE):
     print("[Ycmd][Notify] {}".format(path))
     return server.SendEventNotification(EventEnum.FileReadyToParse,
                                         filepath=path,
                                         filetype=filetype,
-                                        contents=contents)
+                                        contents=contents,
+                                        priority=priority)
 
 
-def SemanticCompletionResults(server, path, row, col, contents, filetype):
+def SemanticCompletionResults(server, path, row, col, contents, filetype,
+                              priority=PRIORITY_INTERACTIVE):
     print("[Ycmd][Completion] for {}:{}:{}".format(path, row, col))
     return server.SendCodeCompletionRequest(filepath=path,
                                             filetype=filetype,
                                             line_num=row,
                                             column_num=col,
-                                            contents=contents)
+                                            contents=contents,
+                                            priority=priority)
+
+def FileDiagnostics(server, path, contents, filetype, priority=PRIORITY_INTERACTIVE):
+    ''' Like PrepareForNewFile, but yields diagnostics as they are decoded '''
+    print("[Ycmd][Notify] {}".format(path))
+    return server.SendEventNotification(EventEnum.FileReadyToParse,
+                                        filepath=path,
+                                        filetype=filetype,
+                                        contents=contents,
+                                        priority=priority,
+                                        stream=True)
+
+
+def SemanticCompletionItems(server, path, row, col, contents, filetype,
+                            priority=PRIORITY_INTERACTIVE):
+    ''' Like SemanticCompletionResults, but yields completions as they are decoded '''
+    print("[Ycmd][Completion] for {}:{}:{}".format(path, row, col))
+    return server.SendCodeCompletionRequest(filepath=path,
+                                            filetype=filetype,
+                                            line_num=row,
+                                            column_num=col,
+                                            contents=contents,
+                                            priority=priority,
+                                            stream=True)
+
 
 def LogServerOutput(stdout):
     for line in iter(stdout.readline, b''):
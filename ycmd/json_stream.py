@@ -0,0 +1,99 @@
+# -*- coding: utf8 -*-
+
+import codecs
+import json
+
+CHUNK_SIZE = 16 * 1024
+# Characters that may follow a complete JSON value
+DELIMITERS = ' \t\r\n,:]}'
+
+
+# Reads JSON values one by one from a binary stream (e.g. HTTP response),
+# keeping in memory only the part of the body that is not decoded yet.
+class JsonStreamReader(object):
+
+    def __init__(self, stream, chunk_size=CHUNK_SIZE):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _Fill(self, size):
+        if self._eof:
+            return False
+        if self._pos:
+            self._buffer = self._buffer[self._pos:]
+            self._pos = 0
+        data = self._stream.read(size)
+        if not data:
+            self._eof = True
+        self._buffer += self._decoder.decode(data, final=self._eof)
+        return True
+
+    def Peek(self):
+        ''' Skips whitespace, returns the next character or '' at the end of stream '''
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos].isspace():
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._Fill(self._chunk_size):
+                return ''
+
+    def Expect(self, char):
+        found = self.Peek()
+        if found != char:
+            raise ValueError("Expected '{}' in JSON stream, found '{}'".format(char, found))
+        self._pos += 1
+
+    def Value(self):
+        self.Peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buffer, self._pos)
+                # a number may continue in the next chunk, so it must be
+                # followed by a delimiter to be complete
+                if self._eof or (end < len(self._buffer) and self._buffer[end] in DELIMITERS):
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            # read at least as much as is buffered, so big values take few retries
+            self._Fill(max(self._chunk_size, len(self._buffer) - self._pos))
+
+
+def IterJsonItems(stream, member=None, chunk_size=CHUNK_SIZE):
+    ''' Yields items of the JSON array read from stream one by one.
+        If member is set, the stream holds an object and items of its member
+        array are yielded (nothing, if there is no such member); members after
+        it are never read. Otherwise an object is taken for an empty array, as
+        ycmd replies {} to events that produce no diagnostics.
+    '''
+    reader = JsonStreamReader(stream, chunk_size)
+    if member is None:
+        if reader.Peek() == '{':
+            return
+    else:
+        reader.Expect('{')
+        while True:
+            if reader.Peek() == '}':
+                return
+            name = reader.Value()
+            reader.Expect(':')
+            if name == member:
+                break
+            reader.Value()
+            if reader.Peek() == ',':
+                reader.Expect(',')
+    reader.Expect('[')
+    if reader.Peek() == ']':
+        return
+    while True:
+        yield reader.Value()
+        if reader.Peek() == ']':
+            return
+        reader.Expect(',')
@@ -0,0 +1,137 @@
+# -*- coding: utf8 -*-
+
+from .exceptions import RequestShed
+import threading
+import time
+
+
+# Limits requests in flight to one server. The limit grows by one per
+# limit's worth of fast responses and is halved (at most once per latency
+# target) on slow responses, errors and backpressure (429/503) responses,
+# AIMD style. Requests released without a latency (ones that are slow by
+# nature, like parsing) only count for errors and backpressure.
+# Interactive requests wait for a free slot and may use one slot above the
+# limit, so background requests can never take all of them; background
+# ones are shed when too many are already waiting, and a background request
+# with the same key as a waiting one replaces it.
+class AdaptiveLimiter(object):
+
+    def __init__(self, initial_limit=4, min_limit=1, max_limit=16,
+                 latency_target=1.0, max_queued=8, timeout=10.0):
+        self._cond = threading.Condition()
+        self._waiting_keys = {}
+        self._interactive_waiting = 0
+        self._background_waiting = 0
+        self._last_decrease = 0
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.limit = float(max(min(initial_limit, max_limit), min_limit))
+        self.in_flight = 0
+        self.blocked_until = 0
+        self.ewma_latency = None
+        self.consecutive_errors = 0
+        self.shed = 0
+        self.coalesced = 0
+
+    def Configure(self, min_limit, max_limit, latency_target, max_queued):
+        with self._cond:
+            self.min_limit = min_limit
+            self.max_limit = max_limit
+            self.latency_target = latency_target
+            self.max_queued = max_queued
+            self.limit = float(max(min(self.limit, max_limit), min_limit))
+            self._cond.notify_all()
+
+    def ResetErrors(self):
+        with self._cond:
+            self.consecutive_errors = 0
+
+    def QueueDepth(self):
+        return self._interactive_waiting + self._background_waiting
+
+    def Stats(self):
+        with self._cond:
+            return {
+                'limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'queued': self.QueueDepth(),
+                'ewma_latency_ms': round((self.ewma_latency or 0) * 1000, 1),
+                'blocked_for': round(max(self.blocked_until - time.time(), 0), 1),
+                'shed': self.shed,
+                'coalesced': self.coalesced,
+            }
+
+    def Acquire(self, interactive, key=None):
+        ''' Waits for a slot. Raises RequestShed if the request is given up '''
+        deadline = time.time() + self.timeout
+        with self._cond:
+            if interactive:
+                self._interactive_waiting += 1
+            else:
+                if self._background_waiting >= self.max_queued and not self._CanRun(False):
+                    self.shed += 1
+                    raise RequestShed('too many queued requests')
+                if key is not None:
+                    if key in self._waiting_keys:
+                        self.coalesced += 1
+                        self._cond.notify_all()
+                    self._waiting_keys[key] = self._waiting_keys.get(key, 0) + 1
+                    ticket = self._waiting_keys[key]
+                self._background_waiting += 1
+            try:
+                while not self._CanRun(interactive):
+                    if not interactive and key is not None and \
+                            self._waiting_keys.get(key) != ticket:
+                        raise RequestShed('replaced by newer request')
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or self.blocked_until - time.time() > remaining:
+                        self.shed += 1
+                        raise RequestShed('timed out waiting for server')
+                    wait = remaining
+                    if self.blocked_until:
+                        wait = min(wait, max(self.blocked_until - time.time(), 0.01))
+                    self._cond.wait(wait)
+                self.in_flight += 1
+            finally:
+                if interactive:
+                    self._interactive_waiting -= 1
+                else:
+                    self._background_waiting -= 1
+                    if key is not None and self._waiting_keys.get(key) == ticket:
+                        del self._waiting_keys[key]
+
+    def Release(self, latency=None, error=False, retry_after=None):
+        now = time.time()
+        with self._cond:
+            self.in_flight -= 1
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            failed = error or retry_after is not None
+            if failed:
+                self.consecutive_errors += 1
+            else:
+                self.consecutive_errors = 0
+                if latency is not None:
+                    if self.ewma_latency is None:
+                        self.ewma_latency = latency
+                    else:
+                        self.ewma_latency = 0.8 * self.ewma_latency + 0.2 * latency
+            if failed or (latency is not None and latency > self.latency_target):
+                if now - self._last_decrease > self.latency_target:
+                    self._last_decrease = now
+                    self.limit = max(self.limit / 2, self.min_limit)
+            elif latency is not None:
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+            self._cond.notify_all()
+
+    def _CanRun(self, interactive):
+        if time.time() < self.blocked_until:
+            return False
+        if interactive:
+            return self.in_flight < int(self.limit) + 1
+        if self._interactive_waiting:
+            return False
+        return self.in_flight < int(self.limit)
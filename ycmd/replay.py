@@ -0,0 +1,127 @@
+# -*- coding: utf8 -*-
+#!/usr/bin/env python
+'''Replays a request trace recorded by the plugin against a ycmd server.
+
+Run from the plugin directory:
+    python -m ycmd.replay trace.jsonl --server http://127.0.0.1 --port 8080 \
+        --hmac BASE64_SECRET --concurrency 8 --speed 2
+'''
+
+from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from .http_client import YcmdClient, PRIORITY_INTERACTIVE
+from .trace import ReadTrace, RestoreContents
+import argparse
+import collections
+import threading
+import time
+
+
+def Percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class ReplayStats(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.lag = []
+
+    def Add(self, handler, latency, lag, error):
+        with self._lock:
+            self.latencies[handler].append(latency)
+            self.lag.append(lag)
+            if error is not None:
+                self.errors[(handler, error)] += 1
+
+    def Report(self, wall_time):
+        lines = []
+        all_latencies = sorted(sum(self.latencies.values(), []))
+        total = len(all_latencies)
+        errors = sum(self.errors.values())
+        lines.append('requests: {}, errors: {} ({:.2%}), wall time: {:.2f}s, '
+                     'throughput: {:.2f} req/s'.format(
+                         total, errors, errors / total if total else 0.0, wall_time,
+                         total / wall_time if wall_time else 0.0))
+        lines.append('max send lag behind schedule: {:.1f}ms'.format(
+            max(self.lag or [0.0]) * 1000))
+        rows = [('all', all_latencies)] + sorted(
+            (handler, sorted(values)) for handler, values in self.latencies.items())
+        lines.append('{:<28} {:>7} {:>9} {:>9} {:>9} {:>9} {:>7}'.format(
+            'handler', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'errors'))
+        for handler, values in rows:
+            handler_errors = errors if handler == 'all' else sum(
+                count for (name, _), count in self.errors.items() if name == handler)
+            lines.append('{:<28} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} {:>7}'.format(
+                handler, len(values),
+                Percentile(values, 50) * 1000, Percentile(values, 90) * 1000,
+                Percentile(values, 99) * 1000, (values[-1] if values else 0.0) * 1000,
+                handler_errors))
+        for (handler, error), count in sorted(self.errors.items()):
+            lines.append('  {} {}: {}'.format(handler, error, count))
+        return '\n'.join(lines)
+
+
+def SendRecord(client, record, scheduled, stats):
+    start = time.time()
+    error = None
+    try:
+        # bypass the client side limiter, the point is to load the server
+        client._DoCallHttp(record['method'], record['handler'], RestoreContents(record['data']),
+                           record.get('priority', PRIORITY_INTERACTIVE), None)
+    except HTTPError as err:
+        error = 'HTTP {}'.format(err.code)
+    except Exception as err:
+        error = type(err).__name__
+    stats.Add(record['handler'], time.time() - start, start - scheduled, error)
+
+
+def Replay(records, client, concurrency, speed):
+    ''' Sends records keeping their recorded spacing divided by speed.
+        With speed 0 records are sent as fast as concurrency allows.
+    '''
+    stats = ReplayStats()
+    start = time.time()
+    first_ts = None
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for record in records:
+            if first_ts is None:
+                first_ts = record['ts']
+            scheduled = time.time()
+            if speed > 0:
+                scheduled = start + (record['ts'] - first_ts) / speed
+                time.sleep(max(scheduled - time.time(), 0))
+            executor.submit(SendRecord, client, record, scheduled, stats)
+    return stats, time.time() - start
+
+
+def Main():
+    parser = argparse.ArgumentParser(description='Replay a ycmd request trace')
+    parser.add_argument('trace', help='JSONL trace written by the plugin')
+    parser.add_argument('--server', default='http://127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--hmac', default='', help='base64 HMAC secret of the server')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='maximum requests in flight')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='time multiplier, 0 sends as fast as possible')
+    parser.add_argument('--handler', action='append',
+                        help='replay only these handlers (may be repeated)')
+    args = parser.parse_args()
+
+    records = ReadTrace(args.trace)
+    if args.handler:
+        records = (record for record in records if record['handler'] in args.handler)
+    client = YcmdClient(None, args.server, args.port, b64decode(args.hmac))
+    stats, wall_time = Replay(records, client, max(args.concurrency, 1), args.speed)
+    print(stats.Report(wall_time))
+
+
+if __name__ == '__main__':
+    Main()
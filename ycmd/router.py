@@ -0,0 +1,106 @@
+# -*- coding: utf8 -*-
+
+from .http_client import YcmdClient, GetLimiter, HEALTH_CHECK_TIMEOUT
+import bisect
+import hashlib
+import threading
+import time
+
+# Points each server gets on the ring, more points spread keys more evenly
+RING_REPLICAS = 64
+# A server failing this many requests in a row is skipped until it passes
+# a health check
+MAX_CONSECUTIVE_ERRORS = 3
+
+
+def RingHash(value):
+    return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+
+# Routes files to one of several ycmd servers by consistent hashing of a
+# routing key (project or directory), so every server keeps translation
+# units of the same files warm, and adding or removing a server moves only
+# the keys of its ring segments.
+# Servers that fail health checks or recent requests are skipped, as are
+# servers whose health check round trip is above slow_latency while a
+# faster candidate exists; the key then goes to the next server on the ring.
+# The round trip is measured whether or not the server gets requests, so a
+# skipped server is picked again once it recovers, and it does not depend
+# on how long the files sent to the server take to parse.
+class ServerRing(object):
+
+    def __init__(self, servers, health_check_interval=10.0, slow_latency=0.5):
+        ''' servers is a list of (server, port, hmac_secret) '''
+        self.servers = tuple(servers)
+        self.slow_latency = slow_latency
+        self._clients = [YcmdClient(0, server, port, hmac_secret)
+                         for server, port, hmac_secret in self.servers]
+        self._healthy = [True] * len(self._clients)
+        self._round_trip = [None] * len(self._clients)
+        self._ring = sorted((RingHash('{}#{}'.format(client._server_location, replica)), index)
+                            for index, client in enumerate(self._clients)
+                            for replica in range(RING_REPLICAS))
+        self._hashes = [point for point, _ in self._ring]
+        self._stopped = threading.Event()
+        if len(self._clients) > 1:
+            t = threading.Thread(target=self._CheckHealth, args=[health_check_interval])
+            t.daemon = True
+            t.start()
+
+    def Stop(self):
+        self._stopped.set()
+
+    def Candidates(self, key):
+        ''' Returns indexes of all servers in ring order starting from key '''
+        start = bisect.bisect(self._hashes, RingHash(key))
+        order = []
+        for i in range(len(self._ring)):
+            index = self._ring[(start + i) % len(self._ring)][1]
+            if index not in order:
+                order.append(index)
+                if len(order) == len(self._clients):
+                    break
+        return order
+
+    def ClientFor(self, key):
+        candidates = self.Candidates(key)
+        available = [index for index in candidates if self._IsAvailable(index)]
+        if not available:
+            return self._clients[candidates[0]]
+        for index in available:
+            if not self._IsSlow(index):
+                return self._clients[index]
+        return self._clients[available[0]]
+
+    def Status(self):
+        return [(client._server_location, self._IsAvailable(index))
+                for index, client in enumerate(self._clients)]
+
+    def _IsAvailable(self, index):
+        limiter = GetLimiter(self._clients[index]._server_location)
+        return self._healthy[index] and limiter.consecutive_errors < MAX_CONSECUTIVE_ERRORS
+
+    def _IsSlow(self, index):
+        round_trip = self._round_trip[index]
+        return round_trip is not None and round_trip > self.slow_latency
+
+    def _CheckHealth(self, interval):
+        while not self._stopped.is_set():
+            for index, client in enumerate(self._clients):
+                # a slow server must time out later than it is found slow
+                start = time.time()
+                healthy = client.IsHealthy(max(HEALTH_CHECK_TIMEOUT, 2 * self.slow_latency))
+                round_trip = time.time() - start
+                if healthy and not self._healthy[index]:
+                    print('[Ycmd][Router] Server is back: {}'.format(client._server_location))
+                elif not healthy and self._healthy[index]:
+                    print('[Ycmd][Router] Server is down: {}'.format(client._server_location))
+                if healthy:
+                    GetLimiter(client._server_location).ResetErrors()
+                    previous = self._round_trip[index]
+                    self._round_trip[index] = round_trip if previous is None else \
+                        0.5 * previous + 0.5 * round_trip
+                else:
+                    self._round_trip[index] = None
+                self._healthy[index] = healthy
+            self._stopped.wait(interval)
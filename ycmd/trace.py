@@ -0,0 +1,80 @@
+# -*- coding: utf8 -*-
+
+import copy
+import json
+import threading
+
+
+# Writes every request sent by YcmdClient as a line of JSON, so real editing
+# sessions can be replayed against a server later (see replay.py).
+# Unless include_contents is set, file contents are replaced with their
+# length, which is enough to send a request of the same size back.
+class TraceRecorder(object):
+
+    def __init__(self, path, include_contents=False):
+        self._path = path
+        self._include_contents = include_contents
+        self._lock = threading.Lock()
+
+    def Record(self, method, handler, data, body_size, response_size,
+               start, duration, status, priority, limiter_stats=None):
+        record = {
+            'ts': start,
+            'method': method,
+            'handler': handler,
+            'priority': priority,
+            'filetype': RequestFiletype(data),
+            'body_size': body_size,
+            'response_size': response_size,
+            'duration_ms': round(duration * 1000, 3),
+            'status': status,
+            'data': data if self._include_contents else RedactContents(data),
+        }
+        if limiter_stats:
+            record['limit'] = limiter_stats['limit']
+            record['in_flight'] = limiter_stats['in_flight']
+            record['queue_depth'] = limiter_stats['queued']
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self._path, 'a', encoding='utf-8') as trace_file:
+                trace_file.write(line + '\n')
+
+
+def RequestFiletype(data):
+    try:
+        file_data = data['file_data'][data['filepath']]
+        return file_data['filetypes'][0]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def RedactContents(data):
+    if not isinstance(data, dict) or 'file_data' not in data:
+        return data
+    data = copy.copy(data)
+    data['file_data'] = dict(data['file_data'])
+    for filepath, file_data in data['file_data'].items():
+        file_data = dict(file_data)
+        file_data['contents_size'] = len(file_data.pop('contents', None) or '')
+        data['file_data'][filepath] = file_data
+    return data
+
+
+def RestoreContents(data):
+    ''' Replaces redacted contents with filler text of the recorded size '''
+    if not isinstance(data, dict) or 'file_data' not in data:
+        return data
+    for file_data in data['file_data'].values():
+        if 'contents_size' in file_data:
+            size = file_data.pop('contents_size')
+            line = ' ' * 79 + '\n'
+            file_data['contents'] = (line * (size // len(line) + 1))[:size]
+    return data
+
+
+def ReadTrace(path):
+    with open(path, encoding='utf-8') as trace_file:
+        for line in trace_file:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
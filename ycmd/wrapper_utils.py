@@ -1,7 +1,7 @@
 #!/usr/bin/env python
 # -*- coding: utf8 -*-
 
-import collections
+import collections.abc
 import json
 
 
@@ -12,9 +12,9 @@ def RecursiveEncodeUnicodeToUtf8(value):
     #     return value.encode('utf8')
     if isinstance(value, str):
         return value
-    elif isinstance(value, collections.Mapping):
+    elif isinstance(value, collections.abc.Mapping):
         return dict(map(RecursiveEncodeUnicodeToUtf8, value.items()))
-    elif isinstance(value, collections.Iterable):
+    elif isinstance(value, collections.abc.Iterable):
         return type(value)(map(RecursiveEncodeUnicodeToUtf8, value))
     else:
         return value